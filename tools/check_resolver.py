@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+check_resolver.py
+Checks that the in-process pyelftools resolver agrees with addr2line.
+
+Usage:
+    ./check_resolver.py <binary_path> [<binary_path> ...]
+
+Every address in a binary's line table, and the byte before each one, is
+resolved with both DwarfLineTable and addr2line; every disagreement is
+printed. Exits with 1 if any were found, 2 if pyelftools is not installed.
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import resolve_symbols  # noqa: E402
+
+# addr2line may append a discriminator to the line, which the line table omits
+DISCRIMINATOR_RE = re.compile(r' \(discriminator \d+\)$')
+
+
+def normalize(location):
+    """Reduce an answer to "filename:line", or None if the line is unknown."""
+    if location is None:
+        return None
+    location = DISCRIMINATOR_RE.sub('', location)
+    if location.endswith((':0', ':?')):
+        return None
+    return location
+
+
+def check_binary(binary_path):
+    """
+    Compare both resolvers on one binary.
+
+    Returns: number of addresses they disagree on (1 if the binary's line
+    table can't be read at all)
+    """
+    try:
+        table = resolve_symbols.DwarfLineTable(binary_path)
+    except Exception as e:
+        print(f"{binary_path}: cannot read line table: {e}", file=sys.stderr)
+        return 1
+    worker = resolve_symbols.Addr2LineWorker(binary_path)
+
+    probes = set()
+    for address in table.addresses:
+        probes.add(address)
+        if address > 0:
+            probes.add(address - 1)
+
+    mismatches = 0
+    try:
+        for address in sorted(probes):
+            hex_address = hex(address)
+            expected = normalize(worker.resolve(hex_address))
+            actual = normalize(table.resolve(hex_address))
+            if actual != expected:
+                mismatches += 1
+                print(f"{binary_path} {hex_address}: pyelftools={actual} "
+                      f"{resolve_symbols.ADDR2LINE_BIN}={expected}")
+    finally:
+        worker.close()
+
+    print(f"{binary_path}: {len(probes)} addresses checked, {mismatches} mismatches")
+    return mismatches
+
+
+def main():
+    """Main entry point."""
+    if len(sys.argv) < 2:
+        print("Usage: check_resolver.py <binary_path> [<binary_path> ...]", file=sys.stderr)
+        sys.exit(1)
+
+    if resolve_symbols.ELFFile is None:
+        print("Error: pyelftools is not installed", file=sys.stderr)
+        sys.exit(2)
+
+    mismatches = sum(check_binary(binary_path) for binary_path in sys.argv[1:])
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,17 +12,79 @@ Usage:
 Environment Variables:
     PROFILER_FULL_STACK=1  - Show full system stack (including libc, libpthread, etc.)
     PROFILER_FULL_STACK=0  - Show only user code frames (default, clean output)
+    PROFILER_ADDR2LINE=<path> - addr2line implementation to use (default: first
+                             of gimli-addr2line, llvm-addr2line, addr2line on PATH).
+                             Setting it also turns off the pyelftools resolver.
+    PROFILER_RESOLVE_CACHE=<dir> - Where resolved addresses are kept between runs
+                             (default: ~/.cache/profiler_resolve)
+    PROFILER_RESOLVE_CACHE=0 - Don't keep resolved addresses between runs
 """
 
 import sys
 import json
 import subprocess
 import os
-from pathlib import Path
+import re
+import shutil
+import functools
+import bisect
+import hashlib
+import fcntl
+import threading
+from dataclasses import dataclass
+
+# orjson parses several times faster than the stdlib and works on raw bytes.
+# It is optional - fall back to json if it isn't installed.
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_DECODE_ERRORS = (orjson.JSONDecodeError, json.JSONDecodeError, UnicodeDecodeError)
+except ImportError:
+    json_loads = json.loads
+    JSON_DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+# pyelftools lets us read .debug_line in-process instead of running addr2line.
+# It is optional - without it every lookup goes through addr2line.
+try:
+    from elftools.elf.elffile import ELFFile
+except ImportError:
+    ELFFile = None
 
 # Check if full stack mode is enabled
 FULL_STACK_MODE = os.environ.get('PROFILER_FULL_STACK', '0') == '1'
 
+# addr2line implementations, fastest first. All accept the same flags (-e, -s).
+ADDR2LINE_CANDIDATES = ('gimli-addr2line', 'llvm-addr2line', 'addr2line')
+
+
+def find_addr2line():
+    """
+    Pick the addr2line implementation to use.
+    
+    PROFILER_ADDR2LINE wins if set; otherwise the first candidate found on PATH.
+    Falls back to plain 'addr2line' so main() can report it as missing.
+    """
+    override = os.environ.get('PROFILER_ADDR2LINE')
+    if override:
+        return override
+    for candidate in ADDR2LINE_CANDIDATES:
+        if shutil.which(candidate):
+            return candidate
+    return 'addr2line'
+
+
+ADDR2LINE_BIN = find_addr2line()
+ADDR2LINE_OVERRIDDEN = bool(os.environ.get('PROFILER_ADDR2LINE'))
+
+# pyelftools is preferred over binutils addr2line. gimli/llvm-addr2line read
+# large binaries much faster than pure Python can, so they win when installed,
+# and so does an addr2line chosen explicitly.
+USE_LINE_TABLES = ELFFile is not None and not ADDR2LINE_OVERRIDDEN and ADDR2LINE_BIN == 'addr2line'
+
+# Name of the resolver this run uses. Backends format some answers
+# differently, so the on-disk cache is kept per backend.
+RESOLVE_BACKEND = 'pyelftools' if USE_LINE_TABLES else re.sub(r'[^A-Za-z0-9.-]', '-', ADDR2LINE_BIN)
+
 # System libraries to filter out in default mode
 SYSTEM_LIBRARIES = {
     'libc.so',
@@ -35,75 +97,531 @@ SYSTEM_LIBRARIES = {
     'libprofiler.so',  # our own profiler
 }
 
+# All SYSTEM_LIBRARIES patterns as one regex, so a check is a single C-level scan
+SYSTEM_LIBRARY_RE = re.compile('|'.join(re.escape(lib) for lib in sorted(SYSTEM_LIBRARIES)))
+
+# addr2line results, keyed by (binary_path, address).
+# Failed lookups are stored as None so they are not retried.
+_ADDR2LINE_CACHE = {}
+
+# Long-running addr2line processes, keyed by binary_path
+_ADDR2LINE_WORKERS = {}
+
+# In-process DWARF line tables, keyed by binary_path (None = not available)
+_LINE_TABLES = {}
+
+# On-disk copy of _ADDR2LINE_CACHE, so repeated runs against the same binary
+# skip resolution entirely. One JSONL file per binary build.
+RESOLVE_CACHE_DIR = os.environ.get(
+    'PROFILER_RESOLVE_CACHE',
+    os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'profiler_resolve')
+)
+DISK_CACHE_ENABLED = RESOLVE_CACHE_DIR != '0'
+
+# Binaries whose on-disk cache has been loaded, and the file it lives in
+_DISK_CACHE_FILES = {}
 
+# Binaries we have given up resolving (no line info, or addr2line too slow)
+_UNRESOLVABLE_BINARIES = set()
+
+# Number of new addresses to collect before resolving them as one batch
+ADDR2LINE_BATCH_SIZE = 256
+
+# Most input lines held back while a batch is being collected
+MAX_PENDING_LINES = 4096
+
+# Bytes read from the profiler output per chunk
+INPUT_CHUNK_SIZE = 64 * 1024
+
+# Seconds building a binary's line table may take before addr2line is used
+# instead, and a whole batch of lookups before the binary is given up on
+ADDR2LINE_BATCH_TIMEOUT = 30
+
+# Only well-formed hex addresses are sent to addr2line (anything else would
+# desynchronize the request/response stream)
+HEX_ADDRESS_RE = re.compile(r'0[xX][0-9a-fA-F]+')
+
+
+@functools.lru_cache(maxsize=512)
 def is_system_library(binary_path):
     """
     Check if a binary is a system library that should be filtered.
     
     Returns True if it's a system library (libc, libpthread, etc.)
+    Cached - the same handful of binary names repeat on every frame.
     """
-    binary_name = Path(binary_path).name
-    for sys_lib in SYSTEM_LIBRARIES:
-        if sys_lib in binary_name:
-            return True
-    return False
+    return SYSTEM_LIBRARY_RE.search(os.path.basename(binary_path)) is not None
 
 
-def resolve_address_with_addr2line(binary_path, address):
+class Addr2LineWorker:
     """
-    Use addr2line to resolve address to filename:line.
+    A single addr2line process kept alive for the whole run.
+    
+    Started without addresses, addr2line reads them from stdin and answers
+    each one on stdout, so the binary is opened and its debug info parsed
+    only once no matter how many addresses we query.
+    
+    Only file:line is requested (-s for base names). Function names (-f) and
+    demangling (-C) are never displayed, and computing them means walking
+    .debug_info, which costs several times more than reading the line table.
+    """
+    
+    def __init__(self, binary_path):
+        self.binary_path = binary_path
+        self.proc = subprocess.Popen(
+            [ADDR2LINE_BIN, '-e', binary_path, '-s'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1
+        )
+    
+    def resolve(self, address):
+        """
+        Resolve one address.
+        
+        Returns: "filename:line" or None if resolution fails
+        """
+        if self.proc is None or not HEX_ADDRESS_RE.fullmatch(address):
+            return None
+        
+        try:
+            self.proc.stdin.write(address + '\n')
+            self.proc.stdin.flush()
+            # addr2line answers each address with one line:
+            # test_simple_leak.c:18
+            answer = self.proc.stdout.readline()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return None
+        
+        if not answer:
+            # addr2line exited - stop using this worker
+            self.close()
+            return None
+        
+        location = answer.strip()  # filename:line
+        # Check if location is valid (not "??:0" or "??:?")
+        if location and not location.startswith('??'):
+            return location
+        return None
+    
+    def close(self):
+        """Shut down the addr2line process."""
+        if self.proc is None:
+            return
+        proc = self.proc
+        self.proc = None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            # Hung - don't let shutdown block on it
+            proc.kill()
+            proc.wait()
+    
+    def kill(self):
+        """Kill a hung addr2line process (a pending resolve() then returns None)."""
+        proc = self.proc
+        if proc is not None:
+            proc.kill()
+
+
+def get_addr2line_worker(binary_path):
+    """
+    Get the addr2line worker for a binary, starting it on first use.
+    
+    Returns: Addr2LineWorker or None if addr2line cannot be started
+    """
+    if binary_path in _UNRESOLVABLE_BINARIES:
+        # Given up on (possibly while this batch was still running)
+        return _ADDR2LINE_WORKERS.get(binary_path)
+    if binary_path not in _ADDR2LINE_WORKERS:
+        try:
+            _ADDR2LINE_WORKERS[binary_path] = Addr2LineWorker(binary_path)
+        except OSError:
+            _ADDR2LINE_WORKERS[binary_path] = None
+    return _ADDR2LINE_WORKERS[binary_path]
+
+
+def close_addr2line_workers():
+    """Shut down all running addr2line workers."""
+    for worker in _ADDR2LINE_WORKERS.values():
+        if worker is not None:
+            worker.close()
+    _ADDR2LINE_WORKERS.clear()
+
+
+class DwarfLineTable:
+    """
+    Address -> "filename:line" table built from a binary's .debug_line.
+    
+    The line programs of all compile units are decoded once (with pyelftools)
+    into a sorted address list, so each lookup is a bisect instead of an
+    addr2line round trip.
+    
+    If abandoned (a threading.Event) gets set while the table is being built,
+    the build stops at the next compile unit with TimeoutError.
+    """
+    
+    def __init__(self, binary_path, abandoned=None):
+        rows = []
+        with open(binary_path, 'rb') as f:
+            elf = ELFFile(f)
+            if not elf.has_dwarf_info():
+                raise ValueError(f"no DWARF info in {binary_path}")
+            dwarf = elf.get_dwarf_info()
+            for cu in dwarf.iter_CUs():
+                if abandoned is not None and abandoned.is_set():
+                    raise TimeoutError(f"gave up reading line info of {binary_path}")
+                lineprog = dwarf.line_program_for_CU(cu)
+                if lineprog is None:
+                    continue
+                file_names = self._file_names(lineprog)
+                sequence_start = len(rows)
+                for entry in lineprog.get_entries():
+                    state = entry.state
+                    if state is None:
+                        continue
+                    # Within a sequence the last row for an address wins
+                    # (an earlier one covers no bytes)
+                    if len(rows) > sequence_start and rows[-1][0] == state.address:
+                        rows.pop()
+                    if state.end_sequence:
+                        # Addresses past the end of a sequence are unknown
+                        rows.append((state.address, None))
+                        sequence_start = len(rows)
+                        continue
+                    filename = file_names.get(state.file)
+                    location = f"{filename}:{state.line}" if filename and state.line else None
+                    rows.append((state.address, location))
+        
+        # Sequences are emitted in no particular address order. Where one ends
+        # at the address the next one starts, the end marker must lose the tie.
+        rows.sort(key=lambda row: (row[0], row[1] is not None))
+        self.addresses = [row[0] for row in rows]
+        self.locations = [row[1] for row in rows]
+    
+    @staticmethod
+    def _file_names(lineprog):
+        """Map line program file indexes to base names (like addr2line -s)."""
+        entries = lineprog['file_entry']
+        # DWARF 5 numbers files from 0, earlier versions from 1
+        first = 0 if lineprog['version'] >= 5 else 1
+        names = {}
+        for index, entry in enumerate(entries, start=first):
+            name = entry.name
+            if isinstance(name, bytes):
+                name = name.decode('utf-8', errors='replace')
+            names[index] = os.path.basename(name)
+        return names
+    
+    def resolve(self, address):
+        """
+        Resolve one address.
+        
+        Returns: "filename:line" or None if resolution fails
+        """
+        if not HEX_ADDRESS_RE.fullmatch(address):
+            return None
+        i = bisect.bisect_right(self.addresses, int(address, 16)) - 1
+        if i < 0:
+            return None
+        return self.locations[i]
+
+
+def get_line_table(binary_path, abandoned=None):
+    """
+    Get the in-process DWARF line table for a binary, building it on first use.
+    
+    abandoned is passed on to DwarfLineTable, to stop a build nobody waits for.
+    
+    Returns: DwarfLineTable or None if pyelftools is missing or not used,
+    the binary has no usable line info, or building the table took too long
+    """
+    if binary_path not in _LINE_TABLES:
+        table = None
+        if USE_LINE_TABLES:
+            try:
+                table = DwarfLineTable(binary_path, abandoned)
+            except Exception:
+                table = None
+        # A build that finishes after being dropped for taking too long
+        # is thrown away
+        _LINE_TABLES.setdefault(binary_path, table)
+    return _LINE_TABLES[binary_path]
+
+
+def disk_cache_path(binary_path):
+    """
+    Get the on-disk cache file for a binary.
+    
+    The name includes the resolver backend and the binary's mtime and size,
+    so switching backends or rebuilding the binary starts a fresh cache.
+    
+    Returns: file path, or None if the binary can't be stat'ed
+    """
+    try:
+        st = os.stat(binary_path)
+    except OSError:
+        return None
+    path_hash = hashlib.sha1(os.path.abspath(binary_path).encode()).hexdigest()
+    return os.path.join(
+        RESOLVE_CACHE_DIR,
+        f"{path_hash}_{RESOLVE_BACKEND}_{st.st_mtime_ns}_{st.st_size}.jsonl"
+    )
+
+
+def load_disk_cache(binary_path):
+    """
+    Load a binary's previously resolved addresses into _ADDR2LINE_CACHE.
+    
+    Only done once per binary; cache files left over from older builds of
+    the same binary are deleted. Any error just means starting cold.
+    """
+    if binary_path in _DISK_CACHE_FILES:
+        return
+    _DISK_CACHE_FILES[binary_path] = None
+    if not DISK_CACHE_ENABLED:
+        return
+    
+    cache_file = disk_cache_path(binary_path)
+    if cache_file is None:
+        return
+    _DISK_CACHE_FILES[binary_path] = cache_file
+    
+    try:
+        # Drop stale caches for older builds of this binary (same backend)
+        prefix = '_'.join(os.path.basename(cache_file).split('_', 2)[:2]) + '_'
+        for name in os.listdir(RESOLVE_CACHE_DIR):
+            if name.startswith(prefix) and name != os.path.basename(cache_file):
+                os.remove(os.path.join(RESOLVE_CACHE_DIR, name))
+        
+        with open(cache_file, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                    _ADDR2LINE_CACHE[(binary_path, entry['addr'])] = entry['location']
+                except (JSON_DECODE_ERRORS, KeyError, TypeError):
+                    # Partially written line - skip it
+                    continue
+    except OSError:
+        pass
+
+
+def save_disk_cache(binary_path, resolved):
+    """
+    Append newly resolved addresses to a binary's on-disk cache.
     
     Args:
         binary_path: Path to the binary
-        address: Hex address string (e.g., "0x4011ea")
+        resolved: dict mapping hex address to "filename:line" or None
+    """
+    cache_file = _DISK_CACHE_FILES.get(binary_path)
+    if cache_file is None or not resolved:
+        return
     
-    Returns: "filename:line" or None if resolution fails
+    data = ''.join(
+        json.dumps({'addr': address, 'location': location}) + '\n'
+        for address, location in resolved.items()
+    )
+    try:
+        os.makedirs(RESOLVE_CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'a') as f:
+            # Exclusive lock so concurrent runs don't interleave lines
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(data)
+    except OSError:
+        pass
+
+
+def has_debug_line(binary_path):
     """
+    Check whether a binary has a .debug_line section to resolve against.
+    
+    Uses pyelftools when available, otherwise readelf. If neither can tell,
+    assume it does and let addr2line try.
+    """
+    if ELFFile is not None:
+        try:
+            with open(binary_path, 'rb') as f:
+                return ELFFile(f).get_section_by_name('.debug_line') is not None
+        except Exception:
+            pass
+    
     try:
-        # Run addr2line
         result = subprocess.run(
-            ['addr2line', '-e', binary_path, '-f', '-C', '-s', '-a', address],
+            ['readelf', '-W', '-S', binary_path],
             capture_output=True,
-            text=True,
-            timeout=2
+            text=True
         )
-        
         if result.returncode == 0:
-            lines = result.stdout.strip().split('\n')
-            # addr2line output format:
-            # 0x4011ea
-            # main
-            # test_simple_leak.c:18
-            if len(lines) >= 3:
-                location = lines[2]  # filename:line
-                # Check if location is valid (not "??:0" or "??:?")
-                if location and not location.startswith('??'):
-                    return location
-        
-    except (subprocess.TimeoutExpired, FileNotFoundError, Exception):
+            return '.debug_line' in result.stdout
+    except (FileNotFoundError, Exception):
         pass
     
-    return None
+    return True
+
 
+def give_up_on_binary(binary_path):
+    """Stop resolving addresses in a binary for the rest of the run."""
+    print(f"Warning: resolving addresses in {binary_path} took longer than "
+          f"{ADDR2LINE_BATCH_TIMEOUT}s; its remaining frames will not be resolved",
+          file=sys.stderr)
+    _UNRESOLVABLE_BINARIES.add(binary_path)
+    worker = _ADDR2LINE_WORKERS.get(binary_path)
+    if worker is not None:
+        worker.kill()
 
-def get_binary_for_address(address, target_binary):
+
+def run_with_deadline(func, *args, timeout):
     """
-    Determine which binary contains this address.
+    Run func(*args) on a daemon thread and wait at most timeout seconds.
     
-    Strategy: Try to resolve with the target binary. If it fails, assume it's a system library.
+    A daemon thread is used so a call that never finishes (a hung addr2line,
+    a huge line table) cannot keep the process alive at exit either.
     
-    Returns: (binary_path, is_system_library, is_target_binary)
+    Returns: (finished, result) - result is None if it did not finish
+    """
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(func(*args)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive() or not outcome:
+        return (False, None)
+    return (True, outcome[0])
+
+
+def _resolve_uncached(resolver, addresses):
     """
-    # First, try to resolve with the target binary
-    resolved = resolve_address_with_addr2line(target_binary, address)
+    Look addresses up with a binary's line table or addr2line worker.
     
-    if resolved and not resolved.startswith('??'):
-        # Successfully resolved - it's in the target binary
-        return (target_binary, False, True)
-    else:
-        # Failed to resolve - assume it's a system library
-        # We don't know which specific library, but mark it as system
-        return ("unknown_library.so", True, False)
+    Runs on a deadline thread. The caller picks (and if need be starts) the
+    resolver and stores the answers, so this only talks to the resolver and
+    a lookup that finishes after its deadline changes nothing.
+    
+    Returns: dict mapping each address to "filename:line" or None
+    """
+    return {address: resolver.resolve(address) for address in addresses}
+
+
+def resolve_addresses_batch(binary_path, addresses):
+    """
+    Resolve many addresses against one binary.
+    
+    Cached addresses (including ones saved by earlier runs) are answered
+    directly; the rest are looked up in the binary's in-process DWARF line
+    table when pyelftools is used, or sent to its long-running addr2line
+    worker otherwise. New results are appended to the on-disk cache.
+    
+    There is no per-address timeout: building the line table gets
+    ADDR2LINE_BATCH_TIMEOUT seconds, after which addr2line is used instead,
+    and the lookup as a whole gets as long again. If that takes longer, the
+    binary is given up on and all its frames are shown unresolved from then
+    on.
+    
+    Args:
+        binary_path: Path to the binary
+        addresses: Iterable of hex address strings (e.g., "0x4011ea")
+    
+    Returns: dict mapping each address to "filename:line" or None
+    """
+    load_disk_cache(binary_path)
+    
+    results = {}
+    pending = []
+    for address in addresses:
+        key = (binary_path, address)
+        if key in _ADDR2LINE_CACHE:
+            results[address] = _ADDR2LINE_CACHE[key]
+        elif address not in results:
+            results[address] = None
+            pending.append(address)
+    
+    if not pending:
+        return results
+    
+    answers, backend = None, None
+    if binary_path not in _UNRESOLVABLE_BINARIES:
+        if USE_LINE_TABLES and binary_path not in _LINE_TABLES:
+            abandoned = threading.Event()
+            finished, _ = run_with_deadline(
+                get_line_table, binary_path, abandoned, timeout=ADDR2LINE_BATCH_TIMEOUT
+            )
+            if not finished:
+                # Too big for pyelftools - stop the build (so it doesn't keep
+                # competing for the GIL) and fall back to addr2line
+                abandoned.set()
+                print(f"Warning: reading line info of {binary_path} took longer than "
+                      f"{ADDR2LINE_BATCH_TIMEOUT}s; using {ADDR2LINE_BIN} instead",
+                      file=sys.stderr)
+                _LINE_TABLES[binary_path] = None
+        
+        table = get_line_table(binary_path)
+        resolver = table or get_addr2line_worker(binary_path)
+        if resolver is not None:
+            finished, answers = run_with_deadline(
+                _resolve_uncached, resolver, pending, timeout=ADDR2LINE_BATCH_TIMEOUT
+            )
+            if not finished:
+                # Too slow - unblock the thread and stop trying this binary
+                give_up_on_binary(binary_path)
+            elif table is not None:
+                backend = 'pyelftools'
+            elif resolver.proc is not None:
+                backend = re.sub(r'[^A-Za-z0-9.-]', '-', ADDR2LINE_BIN)
+    
+    if answers is not None:
+        results.update(answers)
+    for address in pending:
+        _ADDR2LINE_CACHE[(binary_path, address)] = results[address]
+    
+    # Only answers from this run's backend that really ran are kept on disk.
+    # Failures from a binary we gave up on (no line info, timed out) or from
+    # an addr2line that couldn't start or died may not hold next time.
+    if answers is not None and backend == RESOLVE_BACKEND:
+        save_disk_cache(binary_path, answers)
+    
+    return results
+
+
+def resolve_address_with_addr2line(binary_path, address):
+    """
+    Use addr2line to resolve address to filename:line.
+    
+    Args:
+        binary_path: Path to the binary
+        address: Hex address string (e.g., "0x4011ea")
+    
+    Returns: "filename:line" or None if resolution fails
+    
+    Results are memoized per (binary, address) - stack traces repeat the
+    same return addresses constantly, so most lookups never spawn addr2line.
+    """
+    return resolve_addresses_batch(binary_path, [address])[address]
+
+
+def classify_frame(binary_name, target_name):
+    """
+    Classify a frame by the binary name the profiler recorded for it.
+    
+    Uses only the frame's "bin" field - no addr2line call. A frame that is
+    not in the target binary can never be resolved against it, so it is
+    never worth paying for a lookup.
+    
+    Returns: (is_user_code, is_system)
+    """
+    return (binary_name == target_name, is_system_library(binary_name))
+
+
+def write_lines(lines):
+    """Write a block of output lines with a single stdout write."""
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 def format_resolved_location(filename, line_num, is_system):
@@ -119,7 +637,77 @@ def format_resolved_location(filename, line_num, is_system):
         return f"  at: {filename}; line: {line_num}"
 
 
-def process_event_with_frames(event_obj, target_binary):
+def format_frames(frames, target_binary, target_name):
+    """
+    Format the stack frames of one event.
+    
+    This is the per-frame hot loop: module globals are bound to locals once,
+    and resolved locations are read straight from the cache. User-code
+    addresses missing from it are resolved up front in one batch, each
+    distinct address once (recursion and repeated call sites put the same
+    address in a stack several times).
+    
+    Returns: list of output lines (may be empty)
+    """
+    full_stack = FULL_STACK_MODE
+    cache_get = _ADDR2LINE_CACHE.get
+    lines = []
+    append = lines.append
+    
+    # Normally iter_profiler_events has resolved everything already
+    missing = set()
+    for frame in frames:
+        if isinstance(frame, dict) and frame.get('bin') == target_name:
+            frame_addr = frame.get('addr')
+            if isinstance(frame_addr, str) and (target_binary, frame_addr) not in _ADDR2LINE_CACHE:
+                missing.add(frame_addr)
+    if missing:
+        resolve_addresses_batch(target_binary, missing)
+    
+    for frame in frames:
+        if isinstance(frame, dict):
+            frame_addr = frame.get('addr', '?')
+            binary_name = frame.get('bin', 'unknown')
+        else:
+            # Backward compatibility: if frame is just a string address
+            frame_addr = frame
+            binary_name = "unknown"
+        
+        # Determine if this is user code or system library
+        is_user_code, is_system = classify_frame(binary_name, target_name)
+        
+        # In default mode, skip system library frames
+        if is_system and not full_stack:
+            continue
+        
+        # Only frames in the target binary can be resolved against it
+        # (and only string addresses can be, or even looked up)
+        if is_user_code and isinstance(frame_addr, str):
+            resolved = cache_get((target_binary, frame_addr))
+            if resolved and not resolved.startswith('??'):
+                filename, sep, line_num = resolved.rpartition(':')
+                if sep:
+                    # Successfully resolved
+                    if full_stack:
+                        append(f"  [USR] at: {filename}; line: {line_num}")
+                    else:
+                        append(f"  at: {filename}; line: {line_num}")
+                    continue
+        
+        # Unresolved or system library frame
+        if full_stack:
+            if is_system:
+                append(f"  [SYS] <{binary_name}+{frame_addr}>")
+            elif is_user_code:
+                # Unresolved frame in user binary = C runtime startup
+                append(f"  [CRT] <{binary_name}+{frame_addr}>")
+            else:
+                append(f"  [???] <{binary_name}+{frame_addr}>")
+    
+    return lines
+
+
+def process_event_with_frames(event_obj, target_binary, target_name=None):
     """
     Process any event that has frames (leak, corruption, etc.) and print formatted output.
     
@@ -129,6 +717,7 @@ def process_event_with_frames(event_obj, target_binary):
     Args:
         event_obj: Parsed JSON object with "type", "addr", "frames", and optional other fields
         target_binary: Path to the main binary being profiled
+        target_name: Base name of target_binary (computed if not given)
     
     Supported formats:
         {"type":"leak","addr":"0x...","size":123,"frames":[...]}
@@ -139,62 +728,27 @@ def process_event_with_frames(event_obj, target_binary):
     addr = event_obj.get('addr', '?')
     frames = event_obj.get('frames', [])
     
+    # Output is collected and written once per event
+    out = []
+    
     # Print event-specific header
     if event_type == 'leak':
         size = event_obj.get('size', 0)
-        print(f"[LEAK] {addr}: {size} bytes")
+        out.append(f"[LEAK] {addr}: {size} bytes")
     else:
         # All other types are errors/corruption
-        print(f"[CORRUPTION] {event_type} at {addr}")
+        out.append(f"[CORRUPTION] {event_type} at {addr}")
     
     # Get the target binary base name for comparison
-    target_name = Path(target_binary).name
+    if target_name is None:
+        target_name = os.path.basename(target_binary)
     
     # Process each frame (unified logic for all event types)
-    for frame in frames:
-        if isinstance(frame, dict):
-            frame_addr = frame.get('addr', '?')
-            binary_name = frame.get('bin', 'unknown')
-        else:
-            # Backward compatibility: if frame is just a string address
-            frame_addr = frame
-            binary_name = "unknown"
-        
-        # Determine if this is user code or system library
-        is_user_code = (binary_name == target_name)
-        is_system = is_system_library(binary_name)
-        
-        # In default mode, skip system library frames
-        if not FULL_STACK_MODE and is_system:
-            continue
-        
-        # Try to resolve the address with the target binary
-        if is_user_code:
-            resolved = resolve_address_with_addr2line(target_binary, frame_addr)
-            if resolved and ':' in resolved and not resolved.startswith('??'):
-                # Successfully resolved
-                parts = resolved.rsplit(':', 1)
-                if len(parts) == 2:
-                    filename = parts[0]
-                    line_num = parts[1]
-                    if FULL_STACK_MODE:
-                        print(f"  [USR] at: {filename}; line: {line_num}")
-                    else:
-                        print(f"  at: {filename}; line: {line_num}")
-                continue
-        
-        # Unresolved or system library frame
-        if FULL_STACK_MODE:
-            if is_system:
-                print(f"  [SYS] <{binary_name}+{frame_addr}>")
-            elif is_user_code:
-                # Unresolved frame in user binary = C runtime startup
-                print(f"  [CRT] <{binary_name}+{frame_addr}>")
-            else:
-                print(f"  [???] <{binary_name}+{frame_addr}>")
+    out.extend(format_frames(frames, target_binary, target_name))
     
     # Print empty line after stack
-    print()
+    out.append('')
+    write_lines(out)
 
 
 # Legacy aliases for backward compatibility (can be removed later)
@@ -208,85 +762,208 @@ def process_corruption_json(corruption_obj, target_binary):
     return process_event_with_frames(corruption_obj, target_binary)
 
 
-def process_profiler_output(input_stream, target_binary):
+def iter_input_lines(input_stream):
     """
-    Process the profiler output line by line.
-    Handles both JSON events and plain text.
+    Yield the lines of the input, reading it in INPUT_CHUNK_SIZE chunks.
+    
+    Splitting a large chunk in one call is much cheaper than iterating the
+    stream line by line. read1() is used when available so piped input is
+    processed as it arrives instead of waiting for a full chunk.
     """
-    # Track corruption events
-    corruption_count = 0
-    corruption_header_printed = False
+    read = getattr(input_stream, 'read1', input_stream.read)
+    tail = None
     
-    # Print mode indicator at the start
-    if FULL_STACK_MODE:
-        print("=" * 60)
-        print("PROFILER MODE: FULL SYSTEM STACK DUMP")
-        print("(All frames including system libraries will be shown)")
-        print("=" * 60)
-        print()
+    while True:
+        chunk = read(INPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        if tail:
+            chunk = tail + chunk
+        lines = chunk.split(b'\n' if isinstance(chunk, bytes) else '\n')
+        tail = lines.pop()  # incomplete last line, continued by the next chunk
+        yield from lines
+    
+    if tail:
+        yield tail
+
+
+def iter_profiler_events(input_stream, target_binary, target_name):
+    """
+    Read profiler output and yield (line, obj) pairs in input order.
+    
+    input_stream may be binary (preferred - JSON lines are parsed straight
+    from bytes) or text. obj is the parsed JSON event, or None for plain text
+    lines; line is always returned as str.
+    Lines are released as soon as every user-code address seen so far is
+    cached. Otherwise they are buffered until ADDR2LINE_BATCH_SIZE new
+    addresses have been seen, MAX_PENDING_LINES lines are waiting, or the
+    input ends; the new addresses are then resolved as one batch and the
+    buffered lines are released. Formatting then only hits the cache.
+    """
+    pending = []
+    unresolved = set()
     
-    for line in input_stream:
+    for line in iter_input_lines(input_stream):
         line = line.strip()
         
         # Skip empty lines
         if not line:
             continue
         
-        # Try to parse as JSON
-        try:
-            obj = json.loads(line)
-            obj_type = obj.get('type', '')
-            
-            # Check if this is a corruption event (has frames but is not a leak)
-            if 'frames' in obj and obj_type != 'leak':
-                # Print header on first corruption
-                if not corruption_header_printed:
-                    print()
-                    print("========== DOUBLE/INVALID FREE ERRORS ==========")
-                    print()
-                    corruption_header_printed = True
-                
-                # Process and count corruption
-                process_event_with_frames(obj, target_binary)
-                corruption_count += 1
-            
-            # Check if this event has frames (leak events)
-            elif 'frames' in obj:
-                # Unified handler for all events with stack traces
-                process_event_with_frames(obj, target_binary)
-            
-            elif obj_type == 'header':
-                # Header: {"type":"header","leaks_count":2,"total_bytes":1536}
-                count = obj.get('leaks_count', 0)
-                total = obj.get('total_bytes', 0)
-                print()
-                print("========== MEMORY LEAKS ==========")
-                print(f"Found {count} leak(s), {total} bytes total")
-                print()
-            
-            elif obj_type == 'summary':
-                # Summary: {"type":"summary","real_leaks":2,"real_bytes":1536,"libc_leaks":1,"libc_bytes":1024}
-                real_leaks = obj.get('real_leaks', 0)
-                real_bytes = obj.get('real_bytes', 0)
-                libc_leaks = obj.get('libc_leaks', 0)
-                libc_bytes = obj.get('libc_bytes', 0)
-                
-                print("Summary:")
-                print(f"  Real leaks: {real_leaks} allocation(s), {real_bytes} bytes")
-                if libc_leaks > 0:
-                    print(f"  Libc infrastructure: {libc_leaks} allocation(s), {libc_bytes} bytes (ignored)")
-                print(f"  Free errors: {corruption_count}")
-                print("==================================")
-                print()
-            
-            else:
-                # Any other type is treated as a corruption event
-                # Format: {"type":"Double-Free or Invalid-Free","addr":"0x...","frames":[...]}
-                process_corruption_json(obj, target_binary)
+        # Events are JSON objects - anything else is plain text, so don't
+        # make the JSON parser reject it
+        if line[:1] in (b'{', '{'):
+            try:
+                obj = json_loads(line)
+            except JSON_DECODE_ERRORS:
+                obj = None
+        else:
+            obj = None
+        
+        if obj is None and isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        
+        pending.append((line, obj))
         
-        except json.JSONDecodeError:
+        # Collect user-code frame addresses that still need resolving
+        if isinstance(obj, dict):
+            for frame in obj.get('frames', []):
+                if isinstance(frame, dict) and frame.get('bin') == target_name:
+                    frame_addr = frame.get('addr')
+                    # Malformed addresses can't be resolved (and may not even
+                    # be hashable) - leave them to the formatter as-is
+                    if not isinstance(frame_addr, str) or not HEX_ADDRESS_RE.fullmatch(frame_addr):
+                        continue
+                    if (target_binary, frame_addr) not in _ADDR2LINE_CACHE:
+                        unresolved.add(frame_addr)
+        
+        # Nothing left to resolve means nothing to wait for; otherwise hold
+        # lines back until the batch is full or the window gets too long
+        if (not unresolved or len(unresolved) >= ADDR2LINE_BATCH_SIZE
+                or len(pending) >= MAX_PENDING_LINES):
+            if unresolved:
+                resolve_addresses_batch(target_binary, unresolved)
+                unresolved.clear()
+            yield from pending
+            pending = []
+    
+    if unresolved:
+        resolve_addresses_batch(target_binary, unresolved)
+    yield from pending
+
+
+def process_profiler_output(input_stream, target_binary):
+    """
+    Process the profiler output line by line.
+    Handles both JSON events and plain text.
+    """
+    # Print mode indicator at the start
+    if FULL_STACK_MODE:
+        write_lines([
+            "=" * 60,
+            "PROFILER MODE: FULL SYSTEM STACK DUMP",
+            "(All frames including system libraries will be shown)",
+            "=" * 60,
+            "",
+        ])
+    
+    # The target binary name is fixed for the whole run
+    target_name = os.path.basename(target_binary)
+    
+    # Addresses resolved by earlier runs count as already resolved
+    load_disk_cache(target_binary)
+    
+    try:
+        _process_events(input_stream, target_binary, target_name)
+    finally:
+        close_addr2line_workers()
+
+
+@dataclass
+class OutputContext:
+    """State shared by the event handlers during one run."""
+    target_binary: str
+    target_name: str
+    corruption_count: int = 0
+    corruption_header_printed: bool = False
+
+
+def _handle_header(obj, ctx):
+    """Header: {"type":"header","leaks_count":2,"total_bytes":1536}"""
+    count = obj.get('leaks_count', 0)
+    total = obj.get('total_bytes', 0)
+    write_lines([
+        "",
+        "========== MEMORY LEAKS ==========",
+        f"Found {count} leak(s), {total} bytes total",
+        "",
+    ])
+
+
+def _handle_summary(obj, ctx):
+    """Summary: {"type":"summary","real_leaks":2,"real_bytes":1536,"libc_leaks":1,"libc_bytes":1024}"""
+    real_leaks = obj.get('real_leaks', 0)
+    real_bytes = obj.get('real_bytes', 0)
+    libc_leaks = obj.get('libc_leaks', 0)
+    libc_bytes = obj.get('libc_bytes', 0)
+    
+    out = ["Summary:"]
+    out.append(f"  Real leaks: {real_leaks} allocation(s), {real_bytes} bytes")
+    if libc_leaks > 0:
+        out.append(f"  Libc infrastructure: {libc_leaks} allocation(s), {libc_bytes} bytes (ignored)")
+    out.append(f"  Free errors: {ctx.corruption_count}")
+    out.append("==================================")
+    out.append("")
+    write_lines(out)
+
+
+def _handle_leak(obj, ctx):
+    """Leak: {"type":"leak","addr":"0x...","size":123,"frames":[...]}"""
+    process_event_with_frames(obj, ctx.target_binary, ctx.target_name)
+
+
+def _handle_corruption(obj, ctx):
+    """
+    Any other type is treated as a corruption event.
+    Format: {"type":"Double-Free or Invalid-Free","addr":"0x...","frames":[...]}
+    """
+    # Only events with a stack trace are counted as free errors
+    if 'frames' in obj:
+        # Print header on first corruption
+        if not ctx.corruption_header_printed:
+            write_lines(["", "========== DOUBLE/INVALID FREE ERRORS ==========", ""])
+            ctx.corruption_header_printed = True
+        ctx.corruption_count += 1
+    
+    process_event_with_frames(obj, ctx.target_binary, ctx.target_name)
+
+
+# Event "type" -> handler; types not listed are corruption events
+_EVENT_HANDLERS = {
+    'header': _handle_header,
+    'summary': _handle_summary,
+    'leak': _handle_leak,
+}
+
+
+def _process_events(input_stream, target_binary, target_name):
+    """Format every event from the profiler output."""
+    ctx = OutputContext(target_binary, target_name)
+    handlers_get = _EVENT_HANDLERS.get
+    
+    for line, obj in iter_profiler_events(input_stream, target_binary, target_name):
+        if obj is None:
             # Not JSON - print as-is (handles non-JSON stderr output)
-            print(line)
+            write_lines([line])
+            continue
+        
+        event_type = obj.get('type', '')
+        # Only a string can name a handler (a list type isn't even hashable)
+        if isinstance(event_type, str):
+            handler = handlers_get(event_type, _handle_corruption)
+        else:
+            handler = _handle_corruption
+        handler(obj, ctx)
 
 
 def main():
@@ -300,22 +977,36 @@ def main():
     binary_path = sys.argv[2]
     
     # Validate binary exists
-    if not Path(binary_path).exists():
+    if not os.path.exists(binary_path):
         print(f"Error: Binary not found: {binary_path}", file=sys.stderr)
         sys.exit(1)
     
-    # Check if addr2line is available
-    try:
-        subprocess.run(['addr2line', '--version'], capture_output=True, check=True)
-    except (FileNotFoundError, subprocess.CalledProcessError):
-        print("Error: 'addr2line' not found. Please install binutils.", file=sys.stderr)
-        sys.exit(1)
+    # Check if addr2line is available (not needed when pyelftools can do the work)
+    if not USE_LINE_TABLES:
+        try:
+            subprocess.run([ADDR2LINE_BIN, '--version'], capture_output=True, check=True)
+        except (FileNotFoundError, PermissionError, subprocess.CalledProcessError):
+            if ADDR2LINE_OVERRIDDEN:
+                hint = "Check PROFILER_ADDR2LINE."
+            else:
+                hint = "Please install binutils."
+            print(f"Error: '{ADDR2LINE_BIN}' not found or not working. {hint}", file=sys.stderr)
+            sys.exit(1)
+    
+    # Without line info every lookup would fail - don't even try
+    if not has_debug_line(binary_path):
+        print(f"Warning: {binary_path} has no .debug_line section (built without -g?); "
+              "addresses will not be resolved", file=sys.stderr)
+        _UNRESOLVABLE_BINARIES.add(binary_path)
+    
+    # Block-buffer output unless a user is watching it live
+    sys.stdout.reconfigure(line_buffering=sys.stdout.isatty())
     
-    # Process input
+    # Process input (as bytes - the JSON parser consumes them directly)
     if output_file == '-':
-        process_profiler_output(sys.stdin, binary_path)
+        process_profiler_output(sys.stdin.buffer, binary_path)
     else:
-        with open(output_file, 'r') as f:
+        with open(output_file, 'rb') as f:
             process_profiler_output(f, binary_path)
 
 